@@ -1,3 +1,5 @@
+import functools
+import io
 import os
 import platform
 import re
@@ -38,6 +40,7 @@ def ensure_binary(s, encoding="utf-8", errors="strict"):
     raise TypeError(f"not expecting type '{type(s)}'")
 
 
+@functools.lru_cache(maxsize=None)
 def _find_cl():
     """Use vswhere.exe to locate the Microsoft C compiler."""
     host_platform = {
@@ -127,6 +130,16 @@ def _preprocess_msvc(code, extra_cpp_args, debug):
     return res
 
 
+@functools.lru_cache(maxsize=None)
+def _has_cpp():
+    """Whether a `cpp` command can be run."""
+    try:
+        subprocess.check_call(["cpp", "--version"])
+    except (OSError, subprocess.CalledProcessError):
+        return False
+    return True
+
+
 def preprocess(code, extra_cpp_args=None, debug=False):
     if extra_cpp_args is None:
         extra_cpp_args = []
@@ -137,12 +150,9 @@ def preprocess(code, extra_cpp_args=None, debug=False):
     elif platform.system() == "Windows":
         # Since Windows may not have GCC installed, we check for a cpp command
         # first and if it does not run, then use our MSVC implementation
-        try:
-            subprocess.check_call(["cpp", "--version"])
-        except (OSError, subprocess.CalledProcessError):
+        if not _has_cpp():
             return _preprocess_msvc(code, extra_cpp_args, debug)
-        else:
-            cmd = ["cpp"]
+        cmd = ["cpp"]
     else:
         cmd = ["cpp"]
     includes.append(BUILTIN_HEADERS_DIR)
@@ -231,12 +241,12 @@ def translate(code, hdrname, extra_cpp_args=None, whitelist=None, debug=False, r
             regex=regex,
         )
     )
-    pxd_string = ""
+    pxd = io.StringIO()
     if p.stdint_declarations:
         cimports = ", ".join(p.stdint_declarations)
-        pxd_string += f"from libc.stdint cimport {cimports}\n\n"
-    pxd_string += str(p)
-    return pxd_string
+        pxd.write(f"from libc.stdint cimport {cimports}\n\n")
+    p.write(pxd)
+    return pxd.getvalue()
 
 
 WHITELIST = []
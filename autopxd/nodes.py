@@ -4,12 +4,17 @@ from abc import (
 )
 from typing import (
     Iterable,
+    Iterator,
     List,
+    Sequence,
     Union,
 )
 
 
 class PxdNode(metaclass=ABCMeta):
+    # No instance __dict__: subclasses list their fields in __slots__
+    __slots__ = ()
+
     indent: str = "    "
 
     def __str__(self):
@@ -19,6 +24,15 @@ class PxdNode(metaclass=ABCMeta):
     def lines(self) -> List[str]:
         pass
 
+    def indented_lines(self, prefix: str) -> Iterator[str]:
+        """Yield the lines of this node, each already prefixed with **prefix**.
+
+        Nodes with nested lines override this to build each line with a single
+        concatenation instead of one per nesting level.
+        """
+        for line in self.lines():
+            yield prefix + line
+
 
 class IdentifierType(PxdNode):
     __slots__ = ("name", "type_name")
@@ -60,7 +74,7 @@ class Function(PxdNode):
 
 
 class Ptr(IdentifierType):
-    __slots__ = ("node",) + IdentifierType.__slots__
+    __slots__ = ("node",)
 
     node: PxdNode
 
@@ -89,9 +103,9 @@ class Array(IdentifierType):
     __slots__ = ("node", "dimensions")
 
     node: PxdNode
-    dimensions: List[int]
+    dimensions: Sequence[int]
 
-    def __init__(self, node: PxdNode, dimensions: Union[None, List[int]] = None):
+    def __init__(self, node: PxdNode, dimensions: Union[None, Sequence[int]] = None):
         if dimensions is None:
             dimensions = [1]
         self.node = node
@@ -132,13 +146,16 @@ class Block(PxdNode):
         self.statement = statement
 
     def lines(self) -> List[str]:
-        rv = [f"{self.statement} {self.kind} {self.name}"]
+        return list(self.indented_lines(""))
+
+    def indented_lines(self, prefix: str) -> Iterator[str]:
         if self.fields:
-            rv[0] += ":"
+            yield f"{prefix}{self.statement} {self.kind} {self.name}:"
+        else:
+            yield f"{prefix}{self.statement} {self.kind} {self.name}"
+        field_prefix = prefix + self.indent
         for field in self.fields:
-            for line in field.lines():
-                rv.append(self.indent + line)
-        return rv
+            yield from field.indented_lines(field_prefix)
 
 
 class Enum(PxdNode):
@@ -154,11 +171,13 @@ class Enum(PxdNode):
         self.statement = statement
 
     def lines(self) -> List[str]:
-        rv = []
+        return list(self.indented_lines(""))
+
+    def indented_lines(self, prefix: str) -> Iterator[str]:
         if self.name:
-            rv.append(f"{self.statement} enum {self.name}:")
+            yield f"{prefix}{self.statement} enum {self.name}:"
         else:
-            rv.append("cpdef enum:")
+            yield f"{prefix}cpdef enum:"
+        item_prefix = prefix + self.indent
         for item in self.items:
-            rv.append(self.indent + item)
-        return rv
+            yield item_prefix + item
@@ -1,4 +1,5 @@
-import pycparser
+import functools
+
 from pycparser import (
     c_ast,
 )
@@ -20,6 +21,17 @@ from .nodes import (
     Type,
 )
 
+# Node types used by the visitor, bound once rather than looked up on the
+# c_ast module for every isinstance check
+_BinaryOp = c_ast.BinaryOp
+_Constant = c_ast.Constant
+_ID = c_ast.ID
+_ParamList = c_ast.ParamList
+_PtrDecl = c_ast.PtrDecl
+_TypeDecl = c_ast.TypeDecl
+_Typedef = c_ast.Typedef
+_StructOrUnion = (c_ast.Struct, c_ast.Union)
+
 
 def escape(name, include_C_name=False):
     """Avoid name collisions with Python keywords by appending an underscore.
@@ -29,87 +41,125 @@ def escape(name, include_C_name=False):
     """
     if name is not None and name in keywords:
         if include_C_name:
-            name = '{name}_ "{name}"'.format(name=name)
+            name = f'{name}_ "{name}"'
         else:
             name = name + "_"
     return name
 
 
-def parse_enum_value(node, constants):
-    if isinstance(node, c_ast.Constant):
-        if node.type in ("int", "long int"):
-            c_raw = node.value
-            # Convert octal to Python syntax
-            if c_raw[0] == "0" and len(c_raw) > 1 and c_raw[1] in "0123456789":
-                value_as_str = "0o" + c_raw[1:]
-            else:
-                value_as_str = c_raw
+@functools.lru_cache(maxsize=1024)
+def _identifier_type(names):
+    """Return the escaped type name of **names** and the stdint names it uses.
+
+    Headers reference the same handful of types over and over.
+    """
+    type_name = " ".join(escape(name) for name in names)
+    return type_name, tuple(name for name in names if name in STDINT_DECLARATIONS)
 
-            # Remove type suffixes
-            if value_as_str[-1] in "lLuU":
-                value_as_int = int(value_as_str[:-1], base=0)
-            else:
-                value_as_int = int(value_as_str, base=0)
 
-        elif node.type == "char":
-            assert len(node.value) == 3
-            assert node.value[0] == "'"
-            assert node.value[-1] == "'"
+def qualify(type_name, quals):
+    """Prefix **type_name** with the const/volatile qualifiers found in **quals**.
 
-            value_as_int = ord(node.value[1])
-            value_as_str = f"0x{value_as_int:X}"
+    The qualifiers are joined first so the type name is only copied once,
+    e.g.: ["const", "volatile"], int -> volatile const int
+    """
+    prefix = " ".join([qual for qual in ("volatile", "const") if qual in quals])
+    if not prefix:
+        return type_name
+    return f"{prefix} {type_name}"
+
+
+def _parse_enum_constant(node, constants):  # pylint: disable=unused-argument
+    if node.type in ("int", "long int"):
+        c_raw = node.value
+        # Convert octal to Python syntax
+        if c_raw[0] == "0" and len(c_raw) > 1 and c_raw[1] in "0123456789":
+            value_as_str = "0o" + c_raw[1:]
+        else:
+            value_as_str = c_raw
 
+        # Remove type suffixes
+        if value_as_str[-1] in "lLuU":
+            value_as_int = int(value_as_str[:-1], base=0)
         else:
-            assert False, f"Unsuported constant type for enum value: {node}"
-
-    elif isinstance(node, c_ast.BinaryOp):
-        # We wrap the left and right sub-expression with parenthesis to avoid
-        # error when doing advanced arithmetic.
-        # For instance, let's consider the following:
-        # - C input code: `((1 << 2) + 3) * 4` (= 28)
-        # - pycparser: BinaryOp(BinaryOp(BinaryOp(1, "<<", 2), "+", 3), "*", 4)
-        # - output if we wouldn't add parenthesis: 1 << 2 + 3 * 4 (= 16384)
-        #
-        # Note we treat differently the case of a binary expression only composed of
-        # additions in order to improve readability on this very common case (e.g.
-        # `((1 + 2) + 3) + 4` -> `1 + 2 + 3 + 4`).
-
-        def need_parenthesis(sub_node):
-            if isinstance(sub_node, c_ast.Constant):
-                # A scalar never need parenthesis !
-                return False
-
-            if isinstance(sub_node, c_ast.ID):
-                # The ID may correspond to an expression, so we must enclose it in parenthesis
-                return True
-
-            # Parenthesis are superfluous if parent and child are both addition expressions
-            assert isinstance(sub_node, c_ast.BinaryOp)
-            return node.op != "+" or sub_node.op != "+"
-
-        left_value_as_str, _ = parse_enum_value(node.left, constants)
-        if need_parenthesis(node.left):
-            left_value_as_str = f"({left_value_as_str})"
-        right_value_as_str, _ = parse_enum_value(node.right, constants)
-        if need_parenthesis(node.right):
-            right_value_as_str = f"({right_value_as_str})"
-        value_as_str = f"{left_value_as_str} {node.op} {right_value_as_str}"
-        value_as_int = None
-
-    elif isinstance(node, c_ast.ID):
-        try:
-            value_as_str = constants[node.name]
-        except ValueError:
-            assert False, f"Enum value references an unknown constant: {node.name}"
-        value_as_int = None
+            value_as_int = int(value_as_str, base=0)
+
+    elif node.type == "char":
+        assert len(node.value) == 3
+        assert node.value[0] == "'"
+        assert node.value[-1] == "'"
+
+        value_as_int = ord(node.value[1])
+        value_as_str = f"0x{value_as_int:X}"
 
     else:
-        assert False, f"Unsuported expression for enum value: {node}"
+        assert False, f"Unsuported constant type for enum value: {node}"
 
     return value_as_str, value_as_int
 
 
-class AutoPxd(c_ast.NodeVisitor, PxdNode):
+def _parse_enum_binary_op(node, constants):
+    # We wrap the left and right sub-expression with parenthesis to avoid
+    # error when doing advanced arithmetic.
+    # For instance, let's consider the following:
+    # - C input code: `((1 << 2) + 3) * 4` (= 28)
+    # - pycparser: BinaryOp(BinaryOp(BinaryOp(1, "<<", 2), "+", 3), "*", 4)
+    # - output if we wouldn't add parenthesis: 1 << 2 + 3 * 4 (= 16384)
+    #
+    # Note we treat differently the case of a binary expression only composed of
+    # additions in order to improve readability on this very common case (e.g.
+    # `((1 + 2) + 3) + 4` -> `1 + 2 + 3 + 4`).
+
+    def need_parenthesis(sub_node):
+        if isinstance(sub_node, _Constant):
+            # A scalar never need parenthesis !
+            return False
+
+        if isinstance(sub_node, _ID):
+            # The ID may correspond to an expression, so we must enclose it in parenthesis
+            return True
+
+        # Parenthesis are superfluous if parent and child are both addition expressions
+        assert isinstance(sub_node, _BinaryOp)
+        return node.op != "+" or sub_node.op != "+"
+
+    left_value_as_str, _ = parse_enum_value(node.left, constants)
+    if need_parenthesis(node.left):
+        left_value_as_str = f"({left_value_as_str})"
+    right_value_as_str, _ = parse_enum_value(node.right, constants)
+    if need_parenthesis(node.right):
+        right_value_as_str = f"({right_value_as_str})"
+    return f"{left_value_as_str} {node.op} {right_value_as_str}", None
+
+
+def _parse_enum_id(node, constants):
+    try:
+        value_as_str = constants[node.name]
+    except ValueError:
+        assert False, f"Enum value references an unknown constant: {node.name}"
+    return value_as_str, None
+
+
+# Enum value parsers, keyed by the exact c_ast node type
+_ENUM_VALUE_PARSERS = {
+    _Constant: _parse_enum_constant,
+    _BinaryOp: _parse_enum_binary_op,
+    _ID: _parse_enum_id,
+}
+
+
+def parse_enum_value(node, constants):
+    parser = _ENUM_VALUE_PARSERS.get(type(node))
+    assert parser is not None, f"Unsuported expression for enum value: {node}"
+    return parser(node, constants)
+
+
+# NodeVisitor requires one public visit_* method per handled node type
+class AutoPxd(c_ast.NodeVisitor, PxdNode):  # pylint: disable=too-many-public-methods
+    # c_ast node type -> visit_* function, shared by the instances of each class
+    # and built by `_dispatch_table`
+    _dispatch = {}
+
     def __init__(self, hdrname):
         self.hdrname = hdrname
         self.decl_stack = [[]]
@@ -117,23 +167,57 @@ class AutoPxd(c_ast.NodeVisitor, PxdNode):
         self.stdint_declarations = []
         self.dimension_stack = []
         self.constants = {}
+        # Kept in sync with `visit_stack`: the exact type of each node
+        self.type_stack = []
+        self._dispatch_table()
+
+    @classmethod
+    def _dispatch_table(cls):
+        """Map c_ast node types to the visit_* functions of **cls**, built once per class.
+
+        The other node types are mapped to `generic_visit` as they are encountered.
+        """
+        table = cls.__dict__.get("_dispatch")
+        if not table:
+            table = {
+                getattr(c_ast, name[len("visit_") :]): getattr(cls, name)
+                for name in dir(cls)
+                if name.startswith("visit_") and hasattr(c_ast, name[len("visit_") :])
+            }
+            cls._dispatch = table
+        return table
 
     def visit(self, node):
+        node_type = type(node)
         self.visit_stack.append(node)
-        rv = super().visit(node)
+        self.type_stack.append(node_type)
+        dispatch = self._dispatch
+        handler = dispatch.get(node_type)
+        if handler is None:
+            # Remember the fallback too, so that later visits of this type
+            # are a single table lookup
+            handler = dispatch[node_type] = type(self).generic_visit
+        rv = handler(self, node)
+        self.type_stack.pop()
         n = self.visit_stack.pop()
-        assert n == node
+        assert n is node
         return rv
 
+    def generic_visit(self, node):
+        # Nodes iterate over their children directly, unlike `children()`
+        # which builds a tuple of (name, child) pairs on every call
+        for child in node:
+            self.visit(child)
+
     def visit_IdentifierType(self, node):
-        for name in node.names:
-            if name in STDINT_DECLARATIONS and name not in self.stdint_declarations:
+        type_name, stdint_names = _identifier_type(tuple(node.names))
+        for name in stdint_names:
+            if name not in self.stdint_declarations:
                 self.stdint_declarations.append(name)
-        self.append(" ".join(escape(name) for name in node.names))
+        self.append(type_name)
 
     def visit_Block(self, node, kind):
-        type_decl = self.child_of(c_ast.TypeDecl, -2)
-        type_def = type_decl and self.child_of(c_ast.Typedef, -3)
+        type_decl, type_def = self._typedecl_context()
         name = node.name
         if not name:
             if type_def:
@@ -154,13 +238,14 @@ class AutoPxd(c_ast.NodeVisitor, PxdNode):
                 return []
 
             fields = [n for n in self.collect(node) if not hasattr(n, "name") or n.name != ""]
-            for n in fields:
-                if hasattr(n, "name") and prefix != "":
-                    n.name = prefix + n.name
-                    n.name = f'{n.name.split("[")[0]} "{n.name.replace("__", ".")}"'
+            if prefix != "":
+                for n in fields:
+                    if hasattr(n, "name"):
+                        n.name = prefix + n.name
+                        n.name = f'{n.name.split("[")[0]} "{n.name.replace("__", ".")}"'
 
             for n in node.decls:
-                if n.name is None and isinstance(n.type, (pycparser.c_ast.Struct, pycparser.c_ast.Union)):
+                if n.name is None and isinstance(n.type, _StructOrUnion):
                     fields.extend(recursive_flatten_collect(n.type, prefix=prefix))
             return fields
 
@@ -179,13 +264,15 @@ class AutoPxd(c_ast.NodeVisitor, PxdNode):
     def visit_Enum(self, node):
         items = []
         if node.values:
+            constants = self.constants
             maybe_last_value_as_str = None
             maybe_last_value_as_int = None
             index_since_last_str_value = 0
             for item in node.values.enumerators:
                 items.append(escape(item.name, True))
-                if item.value:
-                    value_as_str, maybe_value_as_int = parse_enum_value(item.value, self.constants)
+                item_value = item.value
+                if item_value is not None:
+                    value_as_str, maybe_value_as_int = parse_enum_value(item_value, constants)
                     index_since_last_str_value = 0
                     maybe_last_value_as_str = value_as_str
                     maybe_last_value_as_int = maybe_value_as_int
@@ -205,9 +292,8 @@ class AutoPxd(c_ast.NodeVisitor, PxdNode):
                         maybe_last_value_as_str = None
                         value_as_str = "0"
                 # These constants may be used as array indices:
-                self.constants[item.name] = value_as_str
-        type_decl = self.child_of(c_ast.TypeDecl, -2)
-        type_def = type_decl and self.child_of(c_ast.Typedef, -3)
+                constants[item.name] = value_as_str
+        type_decl, type_def = self._typedecl_context()
         name = node.name
         if not name:
             if type_def:
@@ -237,11 +323,10 @@ class AutoPxd(c_ast.NodeVisitor, PxdNode):
             return
         assert len(decls) == 1
         # Cython supports const and volatile C type qualifiers
-        for qual in ("const", "volatile"):
-            if qual in node.quals:
-                decls[0] = f"{qual} {decls[0]}"
+        if node.quals:
+            decls[0] = qualify(decls[0], node.quals)
         if isinstance(decls[0], str):
-            include_C_name = not self.child_of(c_ast.ParamList)
+            include_C_name = not self.child_of(_ParamList)
             self.append(IdentifierType(escape(node.declname, include_C_name), decls[0]))
         else:
             self.append(decls[0])
@@ -252,7 +337,7 @@ class AutoPxd(c_ast.NodeVisitor, PxdNode):
             return
         assert len(decls) == 1
         if isinstance(decls[0], str):
-            include_C_name = not self.child_of(c_ast.ParamList)
+            include_C_name = not self.child_of(_ParamList)
             self.append(IdentifierType(escape(node.name, include_C_name), decls[0]))
         else:
             self.append(decls[0])
@@ -264,7 +349,7 @@ class AutoPxd(c_ast.NodeVisitor, PxdNode):
         args = decls[:-1]
         if len(args) == 1 and isinstance(args[0], IdentifierType) and args[0].type_name == "void":
             args = []
-        if self.child_of(c_ast.PtrDecl, -2) and not self.child_of(c_ast.Typedef, -3):
+        if self.child_of(_PtrDecl, -2) and not self.child_of(_Typedef, -3):
             # declaring a variable or parameter
             name = self.path_name("ft")
             self.decl_stack[0].append(Type(Ptr(Function(return_type, name, args))))
@@ -277,25 +362,28 @@ class AutoPxd(c_ast.NodeVisitor, PxdNode):
         assert len(decls) == 1
         if isinstance(decls[0], str):
             # Cython supports const and volatile C type qualifiers
-            for qual in ("const", "volatile"):
-                if qual in node.quals:
-                    decls[0] = f"{qual} {decls[0]}"
+            if node.quals:
+                decls[0] = qualify(decls[0], node.quals)
             self.append(decls[0])
         else:
             self.append(Ptr(decls[0], node.quals))
 
     def visit_ArrayDecl(self, node):
-        dim = ""
-        if hasattr(node, "dim"):
-            if hasattr(node.dim, "value"):
-                dim = node.dim.value
-            elif hasattr(node.dim, "name") and node.dim.name in self.constants:
-                dim = str(self.constants[node.dim.name])
+        # pycparser always sets `dim`, it is None for `foo[]`
+        dim_node = node.dim
+        if isinstance(dim_node, _Constant):
+            dim = dim_node.value
+        elif isinstance(dim_node, _ID):
+            dim = self.constants.get(dim_node.name, "")
+        else:
+            # No dimension, or an expression we cannot evaluate
+            dim = ""
         self.dimension_stack.append(dim)
         decls = self.collect(node)
         assert len(decls) == 1
-        self.append(Array(decls[0], self.dimension_stack))
-        self.dimension_stack = []
+        self.append(Array(decls[0], tuple(self.dimension_stack)))
+        # Reuse the stack, the Array node keeps its own copy of the dimensions
+        self.dimension_stack.clear()
 
     def visit_Typedef(self, node):
         decls = self.collect(node)
@@ -317,39 +405,62 @@ class AutoPxd(c_ast.NodeVisitor, PxdNode):
         decls = []
         self.decl_stack.append(decls)
         self.generic_visit(node)
-        assert self.decl_stack.pop() == decls
+        # The pop must stay outside of the assert, asserts are stripped by -O
+        popped = self.decl_stack.pop()
+        assert popped is decls
         return decls
 
     def path_name(self, tag=None):
-        names = []
-        for node in self.visit_stack[:-2]:
-            if hasattr(node, "declname") and node.declname:
-                names.append(node.declname)
-            elif hasattr(node, "name") and node.name:
-                names.append(node.name)
-        if tag is None:
-            return "_".join(names)
+        names = [
+            name
+            for node in self.visit_stack[:-2]
+            if (name := getattr(node, "declname", None) or getattr(node, "name", None))
+        ]
         name = "_".join(names)
+        if tag is None:
+            return name
         return f"_{name}_{tag}"
 
+    def _typedecl_context(self):
+        """Tell whether the node being visited is declared inline in a TypeDecl,
+        and if so whether that TypeDecl belongs to a Typedef.
+        """
+        type_stack = self.type_stack
+        depth = len(type_stack)
+        type_decl = depth >= 2 and type_stack[-2] is _TypeDecl
+        type_def = type_decl and depth >= 3 and type_stack[-3] is _Typedef
+        return type_decl, type_def
+
     def child_of(self, node_type, index=None):
+        # c_ast node classes are never subclassed, so comparing the exact
+        # types is enough
         if index is None:
-            for node in reversed(self.visit_stack):
-                if isinstance(node, node_type):
-                    return True
-            return False
-        return isinstance(self.visit_stack[index], node_type)
+            return node_type in self.type_stack
+        return self.type_stack[index] is node_type
 
     def append(self, node):
         self.decl_stack[-1].append(node)
 
+    def iter_lines(self):
+        """Yield the pxd lines one by one, without materializing the whole file."""
+        yield f'cdef extern from "{self.hdrname}":'
+        decls = self.decl_stack[0]
+        if not decls:
+            yield self.indent + "pass"
+            yield ""
+            return
+        yield ""
+        for decl in decls:
+            yield from decl.indented_lines(self.indent)
+            yield ""
+
     def lines(self):
-        rv = [f'cdef extern from "{self.hdrname}":', ""]
-        for decl in self.decl_stack[0]:
-            for line in decl.lines():
-                rv.append(self.indent + line)
-            rv.append("")
-        if len(rv) == 2:
-            rv[1] = self.indent + "pass"
-            rv.append("")
-        return rv
+        return list(self.iter_lines())
+
+    def write(self, out):
+        """Write the pxd to the text stream **out**, same content as `str(self)`."""
+        lines = self.iter_lines()
+        out.write(next(lines))
+        for line in lines:
+            out.write("\n")
+            out.write(line)
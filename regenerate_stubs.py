@@ -1,9 +1,10 @@
 #!/usr/bin/env python3
 
 import argparse
+import concurrent.futures
 import os
 import platform
-import subprocess
+import tarfile
 import urllib.request
 
 MACOS_SDK_USR_INCLUDE = (
@@ -11,10 +12,13 @@ MACOS_SDK_USR_INCLUDE = (
 )
 
 LIBC_STUB_DOWNLOAD_URL = "https://github.com/eliben/pycparser/archive/main.tar.gz"
+LIBC_STUB_ARCHIVE_PREFIX = "pycparser-main/utils/fake_libc_include/"
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 DEFAULT_OUTPUT_DIR = os.path.join(SCRIPT_DIR, "autopxd/stubs")
 
+MACOS_STUB_CONTENT = b'#include "_fake_defines.h"\n#include "_fake_typedefs.h"\n'
+
 
 def download_libc_stubs(output_dir):
     inc = os.path.join(output_dir, "include")
@@ -22,16 +26,20 @@ def download_libc_stubs(output_dir):
         if len(os.listdir(inc)) > 1:  # In addition to .DS_Store on macOS -- we expect more files anyway
             return
 
-    with urllib.request.urlopen(LIBC_STUB_DOWNLOAD_URL) as include_data:
+    # Stream the archive straight from the response, only extracting the
+    # fake libc headers with their leading directories stripped
+    with urllib.request.urlopen(LIBC_STUB_DOWNLOAD_URL) as include_data, tarfile.open(
+        fileobj=include_data, mode="r|gz"
+    ) as tar:
+        if hasattr(tarfile, "data_filter"):
+            tar.extraction_filter = tarfile.data_filter
         os.makedirs(inc, exist_ok=True)
-        with subprocess.Popen(
-            ["tar", "xfz", "-", f"-C{inc}", "--strip-components=3", "pycparser-main/utils/fake_libc_include/"],
-            stdout=subprocess.PIPE,
-            stdin=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        ) as proc:
-            _, stderr = proc.communicate(input=include_data.read())
-            assert proc.returncode == 0, stderr
+        for member in tar:
+            if not member.name.startswith(LIBC_STUB_ARCHIVE_PREFIX):
+                continue
+            member.name = member.name[len(LIBC_STUB_ARCHIVE_PREFIX) :]
+            if member.name:
+                tar.extract(member, path=inc)
 
 
 def generate_macos_stubs(macos_sdk_usr_include_path, output_dir):
@@ -43,17 +51,15 @@ def generate_macos_stubs(macos_sdk_usr_include_path, output_dir):
             raise Exception(f'"{inc}" already exists and is not a directory')
         return
     for root, _, files in os.walk(macos_sdk_usr_include_path):
+        if not files:
+            continue
+        stub_dir = os.path.join(inc, root.replace(macos_sdk_usr_include_path, ""))
+        os.makedirs(stub_dir, exist_ok=True)
         for file in files:
-            root = root.replace(macos_sdk_usr_include_path, "")
-            stub = os.path.join(inc, root, file)
+            stub = os.path.join(stub_dir, file)
             print(f"Stubbing {stub}")
-            try:
-                os.makedirs(os.path.join(inc, root))
-            except OSError:
-                # already exists
-                pass
-            with open(stub, "w", encoding="utf-8") as stub_f:
-                stub_f.write('#include "_fake_defines.h"\n#include "_fake_typedefs.h"\n')
+            with open(stub, "wb") as stub_f:
+                stub_f.write(MACOS_STUB_CONTENT)
 
 
 def clear_existing_headers(output_dir):
@@ -108,11 +114,17 @@ def main():
 
     if args.clear_existing_headers:
         clear_existing_headers(args.output_dir)
-    download_libc_stubs(args.output_dir)
-    if args.generate_macos_includes:
-        if args.clear_existing_headers:
+        if args.generate_macos_includes:
             clear_existing_macos_headers(args.output_dir)
-        generate_macos_stubs(args.macos_sdk_usr_include_path, args.output_dir)
+
+    # The download waits on the network while the macOS stubs wait on the disk,
+    # run them side by side
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [executor.submit(download_libc_stubs, args.output_dir)]
+        if args.generate_macos_includes:
+            futures.append(executor.submit(generate_macos_stubs, args.macos_sdk_usr_include_path, args.output_dir))
+        for future in futures:
+            future.result()
 
 
 if __name__ == "__main__":
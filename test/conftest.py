@@ -0,0 +1,13 @@
+def pytest_addoption(parser):
+    parser.addoption(
+        "--validate-cython",
+        action="store_true",
+        default=False,
+        help="Also check that every generated pxd is accepted by Cython.",
+    )
+    parser.addoption(
+        "--no-cython-cache",
+        action="store_true",
+        default=False,
+        help="With --validate-cython, also re-check outputs validated by a previous run.",
+    )
@@ -1,64 +1,170 @@
-import glob
+import functools
+import hashlib
+import importlib.metadata
 import os
+import pathlib
 import re
+import subprocess
 import sys
 
 import pytest
-from Cython.Build.Dependencies import (
-    cythonize_one,
-)
-from Cython.Compiler.Main import (
-    CompilationOptions,
-)
 
 import autopxd
 
 FILES_DIR = os.path.join(os.path.dirname(__file__), "test_files")
 
-
-def do_one_cython_vs_header_test(file_path):
+# Any line of dashes separates the C source from the expected Cython output
+SEPARATOR_RE = re.compile(r"^-+$", re.MULTILINE)
+
+# Discovered once and sorted, so that every xdist worker collects the same order
+TEST_FILES = sorted(entry.path for entry in os.scandir(os.path.abspath(FILES_DIR)) if entry.name.endswith(".test"))
+
+# Fixtures needing extra `translate` arguments, by file name
+SPECIAL_CASES = {
+    "whitelist.test": {
+        "whitelist": [os.path.join(FILES_DIR, "tux_foo.h")],
+        "cpp_args": [f"-I{FILES_DIR}"],
+    },
+    "whitelist2.test": {
+        # Only whitelist declarations in 'whitelist2.test' and ignore includes
+        "whitelist": ["<stdin>"],
+        "cpp_args": [f"-I{FILES_DIR}"],
+    },
+}
+
+# Bump when the way markers are keyed or validated changes, to drop stale ones
+CYTHON_CACHE_VERSION = 1
+
+# Passed to Cython's `CompilationOptions`, part of the marker key
+CYTHON_OPTIONS = {
+    "language_level": 3,
+}
+
+
+@functools.lru_cache(maxsize=None)
+def parse_test_file(file_path):
+    """Split a .test file into its C source and the expected Cython output."""
     with open(file_path, encoding="utf-8") as f:
         data = f.read()
-    c, cython = re.split("^-+$", data, maxsplit=1, flags=re.MULTILINE)
-    c = c.strip()
-    cython = cython.strip() + "\n"
+    c, cython = SEPARATOR_RE.split(data, maxsplit=1)
+    return c.strip(), cython.strip() + "\n"
 
-    whitelist = []
-    cpp_args = []
 
-    # Special handling of whitelist.test
-    if file_path.endswith("whitelist.test"):
-        whitelist.append(os.path.join(FILES_DIR, "tux_foo.h"))
-        cpp_args.append(f"-I{FILES_DIR}")
+def do_one_cython_vs_header_test(file_path):
+    c, cython = parse_test_file(file_path)
+    hdrname = os.path.basename(file_path)
 
-    # Special handling of whitelist2.test
-    if file_path.endswith("whitelist2.test"):
-        whitelist.append("<stdin>")  # Only whitelist declarations in 'whitelist2.test' and ignore includes
-        cpp_args.append(f"-I{FILES_DIR}")
+    special_case = SPECIAL_CASES.get(hdrname, {})
+    # Copied, `translate` may extend the arguments
+    whitelist = list(special_case.get("whitelist", []))
+    cpp_args = list(special_case.get("cpp_args", []))
 
-    actual = autopxd.translate(c, os.path.basename(file_path), cpp_args, whitelist)
+    actual = autopxd.translate(c, hdrname, cpp_args, whitelist)
     assert cython == actual, f"\nCYTHON:\n{cython}\n\n\nACTUAL:\n{actual}"
 
     return actual
 
 
-@pytest.mark.parametrize("file_path", glob.glob(os.path.abspath(os.path.join(FILES_DIR, "*.test"))))
-def test_cython_vs_header(file_path, tmp_path):
-    actual = do_one_cython_vs_header_test(file_path)
+@functools.lru_cache(maxsize=None)
+def get_cython_compiler():
+    """Import Cython's compiler on first use, it is only needed with `--validate-cython`.
 
-    # Finally ensure the translation is valid Cython !
-    src = tmp_path / "x.pyx"
-    src.write_text(actual)
-    dst = tmp_path / "x.c"
-    options = CompilationOptions(
-        language_level=3,
+    Returns `cythonize_one` along with the options shared by every validation.
+    """
+    # pylint: disable=import-outside-toplevel
+    from Cython.Build.Dependencies import (
+        cythonize_one,
     )
+    from Cython.Compiler.Main import (
+        CompilationOptions,
+    )
+
+    # `cythonize_one` only overwrites the output file of the options it is given
+    return cythonize_one, CompilationOptions(**CYTHON_OPTIONS)
+
+
+@pytest.fixture(scope="session")
+def validate_workdir(tmp_path_factory):
+    return tmp_path_factory.mktemp("cython-validate")
+
+
+@pytest.fixture(scope="session")
+def cython_cache_dir(pytestconfig):
+    """Directory of the markers of pxd contents which were already successfully cythonized.
+
+    Defaults to pytest's own cache directory, `AUTOPXD_TEST_CACHE` overrides it.
+    """
+    override = os.environ.get("AUTOPXD_TEST_CACHE")
+    if override:
+        return pathlib.Path(override) / "autopxd-validate-cache"
+    # Not available when running with `-p no:cacheprovider`
+    if getattr(pytestconfig, "cache", None) is None:
+        return None
+    return pytestconfig.cache.mkdir("autopxd-validate")
+
+
+def validate_cython(pxd, workdir, cache_dir=None, use_cache=True):
+    """Ensure **pxd** is valid Cython.
+
+    Contents with a marker in **cache_dir** were validated by a previous run and are skipped,
+    unless **use_cache** is false.
+    """
+    key = hashlib.sha256(
+        b"\0".join(
+            [
+                pxd.encode(),
+                str(CYTHON_CACHE_VERSION).encode(),
+                repr(sorted(CYTHON_OPTIONS.items())).encode(),
+                importlib.metadata.version("Cython").encode(),
+                sys.version.encode(),
+                sys.platform.encode(),
+            ]
+        )
+    ).hexdigest()
+    marker = cache_dir / key if cache_dir is not None else None
+    if use_cache and marker is not None and marker.exists():
+        return
+
+    # One subdirectory per pxd contents, shared by the whole session
+    build_dir = workdir / key[:16]
+    build_dir.mkdir(exist_ok=True)
+    src = build_dir / "x.pyx"
+    src.write_text(pxd)
+    dst = build_dir / "x.c"
+    cythonize_one, options = get_cython_compiler()
+    # Quiet only drops the "Cythonizing ..." banner, errors are still reported.
     # Will raise `Cython.Compiler.Errors.CompileError` if the .pyx is invalid
-    cythonize_one(str(src), str(dst), None, False, options=options)
+    cythonize_one(str(src), str(dst), None, True, options=options)
+
+    if marker is not None:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        marker.touch()
+
+
+@pytest.mark.parametrize("file_path", TEST_FILES, ids=os.path.basename)
+def test_cython_vs_header(file_path, request):
+    actual = do_one_cython_vs_header_test(file_path)
+
+    # Finally ensure the translation is valid Cython ! (done on CI, opt-in locally)
+    if request.config.getoption("--validate-cython"):
+        validate_cython(
+            actual,
+            request.getfixturevalue("validate_workdir"),
+            request.getfixturevalue("cython_cache_dir"),
+            use_cache=not request.config.getoption("--no-cython-cache"),
+        )
+
+
+def test_translate_with_optimizations():
+    # Assertions are stripped by `python -O`, this must not change the output
+    code = "struct foo { int a; char *b[2]; }; enum bar { BAZ = 1 }; int qux(struct foo f);"
+    script = f"import autopxd; print(autopxd.translate({code!r}, 'foo.h'), end='')"
+    optimized = subprocess.run([sys.executable, "-O", "-c", script], capture_output=True, text=True, check=True)
+    assert optimized.stdout == autopxd.translate(code, "foo.h")
 
 
 @pytest.mark.skipif(sys.platform != "win32", reason="Windows-only test")
-@pytest.mark.parametrize("file_path", glob.glob(os.path.abspath(os.path.join(FILES_DIR, "*.test"))))
+@pytest.mark.parametrize("file_path", TEST_FILES, ids=os.path.basename)
 def test_cython_vs_header_with_msvc(file_path, monkeypatch):
     monkeypatch.setattr(autopxd, "preprocess", autopxd._preprocess_msvc)  # pylint: disable=protected-access
     do_one_cython_vs_header_test(file_path)